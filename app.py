@@ -5,21 +5,28 @@ OCR & Translation App Backend
 """
 
 import os
+import io
 import time
+import functools
 import base64
+import mmap
 import re
 import traceback
 import tempfile
 import urllib.parse
 import datetime
-import requests
+import orjson
+import ahocorasick
+from requests.adapters import HTTPAdapter
+import requests_cache
+from requests_cache import DO_NOT_CACHE, EXPIRE_IMMEDIATELY
 from flask import Flask, render_template, request, jsonify, url_for, Response
 from mistralai import Mistral
 from openai import OpenAI
-from pypdf import PdfWriter, PdfReader
+import pikepdf
 import threading # 🟢 新增：用于后台异步拉取
 # 🟢 必须添加这一行，否则会报“未定义 ThreadPoolExecutor”
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 app = Flask(__name__)
@@ -41,14 +48,66 @@ GITHUB_BRANCH = os.getenv("GITHUB_BRANCH", "")
 # ==============================================================================
 
 # GitHub API 构造
-GITHUB_API_BASE = f"https://api.github.com/repos/{GITHUB_USER}/{GITHUB_REPO}/contents"
+GITHUB_API_BASE_REPOS = f"https://api.github.com/repos/{GITHUB_USER}/{GITHUB_REPO}"
+GITHUB_API_BASE = f"{GITHUB_API_BASE_REPOS}/contents"
+GITHUB_COMMITS_URL = f"{GITHUB_API_BASE_REPOS}/commits"
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+RAW_BASE = f"https://raw.githubusercontent.com/{GITHUB_USER}/{GITHUB_REPO}/{GITHUB_BRANCH}"
+
 GH_HEADERS = {
     "Authorization": f"token {GITHUB_TOKEN}",
     "Accept": "application/vnd.github.v3+json"
 }
+# Contents API 直接返回文件原始字节 (而不是 base64 JSON)，省掉再请求 download_url 的一跳
+GH_RAW_HEADERS = {**GH_HEADERS, "Accept": "application/vnd.github.raw"}
+
+GH_TIMEOUT = (10, 60)  # GitHub 请求的 (连接, 读取) 超时秒数，避免上游卡住时长期占用 Flask 线程
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """未显式传入 timeout 的请求统一使用 GH_TIMEOUT (requests 的 Session 本身不支持默认超时)"""
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = GH_TIMEOUT
+        return super().send(request, **kwargs)
+
+# 🟢 全局复用的 GitHub 会话：保持 keep-alive，避免每次请求都重新握手 TCP+TLS
+# 同时带 HTTP 缓存，但只缓存文件树列表 (整个仓库只有一条记录，大小有上限)：
+# 缓存条目立即过期，每次都用 ETag 向 GitHub 重新验证，未变化时 GitHub 返回 304 (不计入速率限制)，
+# 直接使用本地缓存的响应体；请求失败时直接抛错，不会拿过期数据顶替。
+# 文件内容 (OCR 结果、译文等) 与其它接口一律不落盘。
+# 缓存目录归本应用所有，权限 0700，避免私有仓库数据暴露在共享的临时目录里。
+GH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+os.makedirs(GH_CACHE_DIR, mode=0o700, exist_ok=True)
+os.chmod(GH_CACHE_DIR, 0o700)
+_gh_session = requests_cache.CachedSession(
+    os.path.join(GH_CACHE_DIR, "gh_cache"),
+    backend="sqlite",
+    expire_after=DO_NOT_CACHE,
+    urls_expire_after={
+        f"api.github.com/repos/{GITHUB_USER}/{GITHUB_REPO}/git/trees": EXPIRE_IMMEDIATELY,
+    },
+    stale_if_error=False,
+)
+_gh_session.headers.update(GH_HEADERS)
+_gh_session.mount("https://", _TimeoutHTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# 同一路径会被反复列出 / 下载 / 删除，缓存编码后的完整 URL，省掉重复的 quote
+@functools.lru_cache(maxsize=4096)
+def _contents_url(path):
+    """仓库内文件路径 -> contents API 地址"""
+    return f"{GITHUB_API_BASE}/{urllib.parse.quote(path)}"
+
+@functools.lru_cache(maxsize=4096)
+def _raw_url(path):
+    """仓库内文件路径 -> raw.githubusercontent.com 下载地址"""
+    return f"{RAW_BASE}/{urllib.parse.quote(path)}"
 
 # --- App 运行参数 ---
 PAGE_CHUNK_SIZE = 5  # PDF 处理分块大小（每5页一组）
+UPLOAD_BUFFER_SIZE = 1 << 20  # 上传文件落盘时的拷贝块大小 (1MB)
+MMAP_THRESHOLD = 1_000_000  # 超过该大小 (字节) 的文件上传时用 mmap 读取
+OCR_MAX_WORKERS = 8  # OCR 并发数上限（Mistral 有速率限制，不宜过大）
+TRANSLATE_MAX_WORKERS = 16  # 翻译并发数上限（线程只阻塞在网络 I/O 上，可比 OCR 开得更大）
 BASE_STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
 
 # --- 用户身份映射 ---
@@ -71,22 +130,31 @@ HISTORY_CACHE = {}
 # 🟢 第二部分：GitHub 工具模块 (GitHub Utils)
 # ==============================================================================
 
-def upload_to_github(file_path, target_path, commit_message):
+def _read_file_b64(file_path):
+    """读取本地文件并返回 Base64 字符串"""
+    # 大文件用 mmap 直接交给 b64encode，省掉一次 f.read() 的整份拷贝
+    with open(file_path, "rb") as f:
+        if os.path.getsize(file_path) > MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return base64.b64encode(mm).decode("ascii")
+        return base64.b64encode(f.read()).decode("ascii")
+
+def upload_to_github(file_path, target_path, commit_message, sha=None):
     """
     功能：将本地文件上传到 GitHub 指定仓库路径。
     
     :param file_path: 本地文件路径
     :param target_path: GitHub 仓库内的目标路径
     :param commit_message: 提交信息
+    :param sha: 目标路径已有文件时必须提供其 blob SHA (覆盖更新)
     :return: Boolean (成功为 True)
     """
     try:
         # 1. 读取文件并转换为 Base64
-        with open(file_path, "rb") as f:
-            content = base64.b64encode(f.read()).decode("utf-8")
+        content = _read_file_b64(file_path)
         
         # 2. 构造 API URL (处理路径中的特殊字符)
-        url = f"{GITHUB_API_BASE}/{urllib.parse.quote(target_path)}"
+        url = _contents_url(target_path)
         
         # 3. 构造请求体
         data = {
@@ -94,9 +162,11 @@ def upload_to_github(file_path, target_path, commit_message):
             "content": content,
             "branch": GITHUB_BRANCH
         }
+        if sha:
+            data["sha"] = sha
         
         # 4. 发送 PUT 请求
-        resp = requests.put(url, json=data, headers=GH_HEADERS)
+        resp = _gh_session.put(url, json=data)
         
         if resp.status_code in [200, 201]:
             return True
@@ -107,20 +177,256 @@ def upload_to_github(file_path, target_path, commit_message):
         print(f"Upload Error: {e}")
         return False
     
+def _create_blob(file_path):
+    """上传单个文件为 Git blob，返回 blob SHA"""
+    resp = _gh_session.post(f"{GITHUB_API_BASE_REPOS}/git/blobs",
+                            json={"content": _read_file_b64(file_path), "encoding": "base64"})
+    if resp.status_code != 201:
+        raise Exception(f"Create blob failed: {resp.text}")
+    return resp.json()['sha']
+
+def _commit_tree_entries(entries, commit_message):
+    """
+    功能：基于分支当前的 tree，用给定的 tree 条目创建一个新提交并移动分支 (tree -> commit -> ref)。
+    任一步失败时抛出异常，由调用方决定如何回退。
+
+    :param entries: Git Trees API 的条目列表 (sha 为 None 表示删除该路径)
+    :param commit_message: 提交信息
+    """
+    # 1. 获取分支当前指向的提交及其 tree (branches 接口一次返回两者)
+    branch_resp = _gh_session.get(f"{GITHUB_API_BASE_REPOS}/branches/{GITHUB_BRANCH}")
+    if branch_resp.status_code != 200:
+        raise Exception(f"Get branch failed: {branch_resp.text}")
+    head_commit = branch_resp.json()['commit']
+    parent_sha = head_commit['sha']
+    base_tree = head_commit['commit']['tree']['sha']
+
+    # 2. 基于当前 tree 创建新 tree
+    tree_resp = _gh_session.post(f"{GITHUB_API_BASE_REPOS}/git/trees", json={
+        "base_tree": base_tree,
+        "tree": entries
+    })
+    if tree_resp.status_code != 201:
+        raise Exception(f"Create tree failed: {tree_resp.text}")
+
+    # 3. 创建提交并移动分支
+    new_commit = _gh_session.post(f"{GITHUB_API_BASE_REPOS}/git/commits", json={
+        "message": commit_message,
+        "tree": tree_resp.json()['sha'],
+        "parents": [parent_sha]
+    })
+    if new_commit.status_code != 201:
+        raise Exception(f"Create commit failed: {new_commit.text}")
+    patch_resp = _gh_session.patch(f"{GITHUB_API_BASE_REPOS}/git/refs/heads/{GITHUB_BRANCH}", json={"sha": new_commit.json()['sha']})
+    if patch_resp.status_code != 200:
+        raise Exception(f"Update ref failed: {patch_resp.text}")
+
+def upload_many_to_github(files, commit_message):
+    """
+    功能：通过 Git Data API 把多个本地文件放进同一个提交 (blobs -> tree -> commit -> ref)。
+    批量提交失败时 (如分支在此期间被其他提交更新)，回退为逐个 upload_to_github。
+
+    :param files: [(本地文件路径, GitHub 仓库内的目标路径), ...]
+    :param commit_message: 提交信息
+    :return: Boolean (成功为 True)
+    """
+    blob_shas = [None] * len(files)
+    try:
+        # 并发上传所有 blob，再一次性提交
+        with ThreadPoolExecutor(max_workers=len(files)) as executor:
+            blob_shas = list(executor.map(_create_blob, [local for local, _ in files]))
+        _commit_tree_entries([
+            {"path": target, "mode": "100644", "type": "blob", "sha": sha}
+            for (_, target), sha in zip(files, blob_shas)
+        ], commit_message)
+        return True
+    except Exception as e:
+        print(f"Batch Upload Error: {e}，回退为逐个上传")
+        return all(_fallback_upload(local, target, blob_sha, commit_message)
+                   for (local, target), blob_sha in zip(files, blob_shas))
+
+def _fallback_upload(file_path, target_path, blob_sha, commit_message):
+    """
+    批量提交失败后的逐个上传。批量提交可能其实已生效 (如更新 ref 时超时)，
+    因此先查目标路径：内容一致直接视为成功，已存在其它内容则带上 SHA 覆盖，避免 PUT 返回 422。
+    """
+    try:
+        meta = _gh_session.get(_contents_url(target_path))
+    except Exception as e:
+        print(f"Upload Error: {e}")
+        return False
+    if meta.status_code == 200:
+        existing_sha = meta.json().get('sha')
+        if blob_sha and existing_sha == blob_sha:
+            return True
+        return upload_to_github(file_path, target_path, commit_message, sha=existing_sha)
+    return upload_to_github(file_path, target_path, commit_message)
+
+def delete_many_from_github(paths, commit_message):
+    """
+    功能：在同一个提交里删除多个文件 (tree 条目 sha 为 None 即删除)。
+    已不存在的路径会被跳过；批量提交失败时回退为逐个 DELETE。
+
+    :param paths: GitHub 仓库内的文件路径列表
+    :param commit_message: 提交信息
+    :return: (["<路径>: <结果>", ...]，与路径顺序一致, 存在的文件是否全部删除成功)
+    """
+    # 1. 并发确认哪些文件存在 (逐个删除的回退路径需要 SHA)
+    def _get_meta(url):
+        try:
+            return _gh_session.get(url)
+        except Exception as e:
+            print(f"Get Meta Error: {e}")
+            return None
+
+    urls = [_contents_url(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        metas = list(executor.map(_get_meta, urls))
+
+    # 只有 404 才算文件不存在；限流 / 5xx / 请求异常都视为删除失败，避免误删本地缓存条目
+    existing = []
+    results = {}
+    all_deleted = True
+    for path, url, meta in zip(paths, urls, metas):
+        if meta is None:
+            results[path] = "失败 (查询文件信息出错)"
+            all_deleted = False
+        elif meta.status_code == 404:
+            results[path] = "跳过 (文件不存在)"
+        elif meta.status_code == 200:
+            existing.append((path, url, meta.json().get('sha')))
+        else:
+            results[path] = f"失败 (查询文件信息返回 {meta.status_code})"
+            all_deleted = False
+
+    if existing:
+        try:
+            # 2. 一次提交删除全部存在的文件
+            _commit_tree_entries([
+                {"path": path, "mode": "100644", "type": "blob", "sha": None}
+                for path, _, _ in existing
+            ], commit_message)
+            for path, _, _ in existing:
+                results[path] = "200"
+        except Exception as e:
+            print(f"Batch Delete Error: {e}，回退为逐个删除")
+            for path, url, sha in existing:
+                del_resp = _gh_session.delete(url, json={
+                    "message": commit_message,
+                    "sha": sha,
+                    "branch": GITHUB_BRANCH
+                })
+                results[path] = str(del_resp.status_code)
+                if del_resp.status_code != 200:
+                    all_deleted = False
+
+    return [f"{path}: {results[path]}" for path in paths], all_deleted
+
+def _parse_gh_date(date_str):
+    """将 GitHub 返回的 ISO 时间 (如 2025-01-01T00:00:00Z) 转为 Unix 时间戳"""
+    return datetime.datetime.fromisoformat(date_str.replace('Z', '+00:00')).timestamp()
+
+def _fetch_commit_timestamps(paths):
+    """
+    功能：通过一次 GraphQL 请求，批量获取多个文件最近一次提交的时间。
+
+    :param paths: GitHub 仓库内的文件路径列表
+    :return: {path: timestamp} 字典；GraphQL 请求失败时返回 None（由调用方回退到 REST）
+    """
+    if not paths:
+        return {}
+
+    # 每个文件对应一个别名 (p0, p1, ...)，共用同一个分支的提交历史
+    fields = "\n".join(
+        f"p{i}: history(first: 1, path: $p{i}) {{ nodes {{ committedDate }} }}"
+        for i in range(len(paths))
+    )
+    var_defs = ", ".join(f"$p{i}: String!" for i in range(len(paths)))
+    query = f"""
+    query($owner: String!, $name: String!, $branch: String!, {var_defs}) {{
+      repository(owner: $owner, name: $name) {{
+        ref(qualifiedName: $branch) {{
+          target {{ ... on Commit {{ {fields} }} }}
+        }}
+      }}
+    }}
+    """
+    variables = {"owner": GITHUB_USER, "name": GITHUB_REPO, "branch": GITHUB_BRANCH}
+    variables.update({f"p{i}": path for i, path in enumerate(paths)})
+
+    try:
+        resp = _gh_session.post(GITHUB_GRAPHQL_URL, json={"query": query, "variables": variables})
+        if resp.status_code != 200:
+            return None
+        payload = orjson.loads(resp.content)
+        if payload.get('errors'):
+            return None
+        target = payload['data']['repository']['ref']['target']
+
+        timestamps = {}
+        for i, path in enumerate(paths):
+            nodes = target[f"p{i}"]['nodes']
+            if nodes:
+                timestamps[path] = _parse_gh_date(nodes[0]['committedDate'])
+        return timestamps
+    except Exception as e:
+        print(f"GraphQL Timestamp Query Failed: {e}")
+        return None
+
+def _list_user_tree(user_id, etag=None):
+    """
+    功能：用 Git Trees API (recursive=1) 一次请求拿到整棵文件树，筛出该用户目录下的文件。
+
+    :param user_id: 用户 ID (即仓库内的一级目录名)
+    :param etag: 上次请求返回的 ETag，传入后做条件请求
+    :return: (状态码, 文件列表 [{'name', 'path'}], 新 ETag)；304 或失败时文件列表为 None
+    """
+    tree_url = f"{GITHUB_API_BASE_REPOS}/git/trees/{GITHUB_BRANCH}"
+    headers = {'If-None-Match': etag} if etag else None
+    resp = _gh_session.get(tree_url, params={'recursive': 1}, headers=headers)
+    # HTTP 缓存层会把 304 换成缓存里的 200 响应：ETag 未变即视为未修改
+    if etag and getattr(resp, 'from_cache', False) and resp.headers.get('ETag') == etag:
+        return 304, None, etag
+    if resp.status_code != 200:
+        return resp.status_code, None, etag
+
+    payload = orjson.loads(resp.content)
+    if payload.get('truncated'):
+        # 仓库过大时 GitHub 会截断文件树，回退到只列出该用户目录
+        resp = _gh_session.get(f"{GITHUB_API_BASE}/{user_id}")
+        if resp.status_code != 200:
+            return resp.status_code, None, etag
+        entries = [{'name': i['name'], 'path': i['path']}
+                   for i in orjson.loads(resp.content) if i['type'] == 'file']
+        return 200, entries, None
+
+    # 只保留用户目录下的直接子文件 (与原 contents 列表一致，不含子目录)
+    prefix = f"{user_id}/"
+    entries = []
+    for node in payload['tree']:
+        path = node['path']
+        if node['type'] == 'blob' and path.startswith(prefix) and '/' not in path[len(prefix):]:
+            entries.append({'name': path[len(prefix):], 'path': path})
+    return 200, entries, resp.headers.get('ETag')
+
 # ==================== 🟢 提取：独立的 GitHub 获取函数 ====================
 # 这个函数负责干脏活累活，不直接处理 HTTP 请求，方便被各种路由调用
 def _fetch_github_data(user_id):
     # 1. 获取当前目录下所有文件
-    contents_url = f"{GITHUB_API_BASE}/{user_id}"
-    resp = requests.get(contents_url, headers=GH_HEADERS)
-    if resp.status_code != 200: return []
+    # 已有缓存时带上 ETag 做条件请求：文件树未变化时 GitHub 返回 304 (无响应体)，直接沿用缓存
+    # 记下开始同步时的版本号：同步期间若有 append / 删除写入缓存，本次结果不覆盖它们
+    start_version, cached_items = history_manager.snapshot(user_id)
+    etag = history_manager.etag.get(user_id) if cached_items is not None else None
+    status, items, new_etag = _list_user_tree(user_id, etag)
+    if status == 304:
+        history_manager.touch(user_id)
+        return cached_items
+    if status != 200: return []
     
-    items = resp.json()
     files_groups = {}
     
     # 2. 正常进行分组逻辑
     for item in items:
-        if item['type'] != 'file': continue
         full_name = item['name']
         path = item['path']
         base_name, ext = os.path.splitext(full_name)
@@ -143,24 +449,33 @@ def _fetch_github_data(user_id):
     sorted_group_keys = sorted(files_groups.keys(), reverse=True)
 
     # 4. 🟢 只针对前 7 个“存在的”组进行具体时间戳查询
-    count = 0
-    for origin_base in sorted_group_keys:
-        if count >= 7: break
-        
-        data = files_groups[origin_base]
-        # 只有存在 PDF 的组才计入查询额度
-        if data['pdf']:
-            try:
-                commit_url = f"https://api.github.com/repos/{GITHUB_USER}/{GITHUB_REPO}/commits"
-                c_resp = requests.get(commit_url, 
-                                    params={'path': data['pdf'], 'per_page': 1},
-                                    headers=GH_HEADERS)
-                if c_resp.status_code == 200 and c_resp.json():
-                    date_str = c_resp.json()[0]['commit']['committer']['date']
-                    data['timestamp'] = datetime.datetime.fromisoformat(date_str.replace('Z', '+00:00')).timestamp()
-            except Exception:
-                pass
-            count += 1
+    # 只有存在 PDF 的组才计入查询额度
+    recent_keys = [k for k in sorted_group_keys if files_groups[k]['pdf']][:7]
+
+    # 4.1 优先用一次 GraphQL 请求批量拿到所有时间戳
+    timestamps = _fetch_commit_timestamps([files_groups[k]['pdf'] for k in recent_keys])
+    if timestamps is not None:
+        for origin_base in recent_keys:
+            data = files_groups[origin_base]
+            data['timestamp'] = timestamps.get(data['pdf'], 0)
+    else:
+        # 4.2 GraphQL 不可用时，回退到 REST 查询（并发发出，互不等待）
+        if recent_keys:
+            with ThreadPoolExecutor(max_workers=len(recent_keys)) as executor:
+                tasks = {
+                    executor.submit(_gh_session.get, GITHUB_COMMITS_URL,
+                                    params={'path': files_groups[k]['pdf'], 'per_page': 1}): k
+                    for k in recent_keys
+                }
+                for future in as_completed(tasks):
+                    try:
+                        c_resp = future.result()
+                        commits = orjson.loads(c_resp.content) if c_resp.status_code == 200 else None
+                        if commits:
+                            date_str = commits[0]['commit']['committer']['date']
+                            files_groups[tasks[future]]['timestamp'] = _parse_gh_date(date_str)
+                    except Exception:
+                        pass
 
     # 5. 构建最终列表（保持排序顺序）
     history_items = []
@@ -168,17 +483,14 @@ def _fetch_github_data(user_id):
         data = files_groups[origin_base]
         if data['pdf'] and data['mds']:
             for md_info in data['mds']:
-                history_items.append({
-                    'name': md_info['display_name'],
-                    'pdf_path': data['pdf'],
-                    'md_path': md_info['path'],
-                    'timestamp': data['timestamp']
-                })
+                history_items.append(_history_item(
+                    md_info['display_name'], data['pdf'], md_info['path'], data['timestamp']
+                ))
     
     # 最后一次根据 timestamp 强制校准（确保前7个在最上，其余在下）
     history_items.sort(key=lambda x: x['timestamp'], reverse=True)
     
-    history_manager.set(user_id, history_items)
+    history_manager.set(user_id, history_items, etag=new_etag, if_version=start_version)
     return history_items
     
 # ==================== 🟢 新增：后台刷新任务 ====================
@@ -187,21 +499,86 @@ def background_refresh_task(user_id):
     with app.app_context(): # 确保有 Flask 上下文（虽然这里主要用 requests）
         _fetch_github_data(user_id)
 
+def _history_item(name, pdf_path, md_path, timestamp):
+    """历史列表条目 (_fetch_github_data 与上传后 append 共用同一结构)"""
+    return {'name': name, 'pdf_path': pdf_path, 'md_path': md_path, 'timestamp': timestamp}
+
+# gh_proxy 的固定前缀；列表 URL 在写入缓存时拼好，避免每次请求逐条调用 url_for
+_GH_PROXY_PREFIX = '/gh_proxy?path='
+
+@functools.lru_cache(maxsize=4096)
+def _proxy_url(path):
+    """与 url_for('gh_proxy', path=...) 生成的结果一致 (空格编码为 +，保留 /)"""
+    return _GH_PROXY_PREFIX + urllib.parse.quote_plus(path, safe="/!$'()*,:;?@")
+
 # 🟢 修改第一部分：改进缓存逻辑
 # 使用一个带锁的类来管理缓存，防止多线程竞争，并增加简单的本地持久化（可选）
 class HistoryManager:
     def __init__(self):
-        self.cache = {}
+        self.cache = {}  # {user_id: (版本号, 列表)}，版本号每次写入自增，与列表一起整体替换
         self.last_sync = {}
+        self.etag = {}  # 每个用户目录列表的 ETag，用于 GitHub 条件请求
+        self.responses = {}  # /history/list 序列化后的响应缓存: {user_id: (version, bytes)}
+        # 进程标识：版本号重启后会从头计数，拼进 ETag 防止与上个进程发出的 ETag 撞车
+        self.instance_id = f"{os.getpid():x}-{time.time_ns():x}"
         self.lock = threading.Lock()
 
     def get(self, user_id):
+        return self.snapshot(user_id)[1]
+
+    def snapshot(self, user_id):
+        """同时取出 (版本号, 列表)；从未同步过时为 (0, None)"""
+        # 读路径不加锁：self.cache 只会被整体替换 (copy-on-write)，版本号和列表存在同一个元组里，
+        # 一次字典读取拿到的总是同一次写入的完整快照
+        return self.cache.get(user_id, (0, None))
+
+    def set(self, user_id, data, etag=None, if_version=None):
+        """
+        :param if_version: 传入时只有当前版本号仍等于它才写入 (用于后台同步：
+                          同步期间若有 append / 删除等写入，旧的文件树结果直接丢弃)
+        :return: Boolean (是否写入)
+        """
+        # 预先补全代理 URL，列表接口可直接返回缓存内容
+        for item in data:
+            item['pdf_url'] = _proxy_url(item['pdf_path'])
+            item['md_url'] = _proxy_url(item['md_path'])
+        with self.lock:
+            version = self.snapshot(user_id)[0]
+            if if_version is not None and version != if_version:
+                return False
+            new_cache = dict(self.cache)
+            new_cache[user_id] = (version + 1, data)
+            self.cache = new_cache
+            self.last_sync[user_id] = time.time()
+            self.responses.pop(user_id, None)
+            if etag:
+                self.etag[user_id] = etag
+        return True
+
+    def append(self, user_id, item):
+        """
+        新上传的文件直接插到列表最前面 (时间最新)，不必重新拉取 GitHub 文件树。
+        该用户还没有缓存时不做处理，下次请求列表时会完整同步。
+        """
+        item['pdf_url'] = _proxy_url(item['pdf_path'])
+        item['md_url'] = _proxy_url(item['md_path'])
+        with self.lock:
+            version, items = self.snapshot(user_id)
+            if items is None:
+                return
+            new_cache = dict(self.cache)
+            new_cache[user_id] = (version + 1, [item] + items)
+            self.cache = new_cache
+            self.responses.pop(user_id, None)
+
+    def forget_etag(self, user_id):
+        """丢弃该用户的目录 ETag，下次同步时强制完整拉取文件树"""
         with self.lock:
-            return self.cache.get(user_id)
+            self.etag.pop(user_id, None)
 
-    def set(self, user_id, data):
+    def touch(self, user_id):
+        """数据未变化 (如 GitHub 返回 304)，只更新同步时间，不使响应缓存失效"""
         with self.lock:
-            self.cache[user_id] = data
             self.last_sync[user_id] = time.time()
 
 history_manager = HistoryManager()
@@ -210,6 +587,54 @@ history_manager = HistoryManager()
 # 🟢 第三部分：翻译引擎模块 (Translation Engine - Advanced Isolation)
 # ==============================================================================
 
+# --- 🟢 预编译正则 (模块加载时编译一次，避免每个 Chunk 重复解析) ---
+# 所有占位符 (用于还原)，group(1) 为前缀 (IMG / TBL / EQ_BLOCK / EQ_INLINE / CODE ...)
+_RE_PLACEHOLDER = re.compile(r'\[\[__([A-Z_]+)_\d+__\]\]')
+# 译文行中需要删除的组件占位符：图片、表格、块级公式
+# (可选：如果你希望译文里也不要行内公式，可以加入 'EQ_INLINE')
+_COMPONENT_PREFIXES = ('IMG', 'TBL', 'EQ_BLOCK')
+
+# ContentIsolator 的保护规则 (与原先 re.sub 调用保持相同的 MULTILINE | DOTALL 标志)
+_PAT_CODE = re.compile(r'```[\s\S]*?```', re.M | re.S)
+_PAT_IMG = re.compile(r'!\[.*?\]\(.*?\)', re.M | re.S)
+_PAT_TBL = re.compile(r'(?:^\|.*?\|\s*$\n?)+', re.M | re.S)
+_PAT_EQB = re.compile(r'\$\$[\s\S]*?\$\$', re.M | re.S)
+_PAT_EQI = re.compile(r'(?<!\\)\$(?!\s).*?(?<!\s)(?<!\\)\$', re.M | re.S)
+
+# 目录切分
+_RE_TOC_CHAPTER = re.compile(r'^\d+\s+[A-Z\u4e00-\u9fa5]')
+
+# 后端清洗
+AD_KEYWORDS = [
+    '获取更多资讯', '优质更多资讯', '國立臺灣大學','数字模型', '数学模型','I would like to get more information.', 
+    '上海', '天津', '文汇', '云江', '太江', '云计', '交往','文江','資訊','大江','关注数学'
+]
+# 广告关键词用 Aho-Corasick 自动机一次扫描匹配，避免多分支正则逐行回溯
+_AD_AUTOMATON = ahocorasick.Automaton()
+for _kw in AD_KEYWORDS:
+    _AD_AUTOMATON.add_word(_kw, _kw)
+_AD_AUTOMATON.make_automaton()
+
+# HTML 实体 -> LaTeX/符号 (二次转义在前，保证优先匹配)
+_HTML_ENTITIES = {
+    '&amp;lt;': '<', '&lt;': '<',
+    '&amp;gt;': '>', '&gt;': '>',
+    '&amp;le;': r'\le', '&le;': r'\le',
+    '&amp;ge;': r'\ge', '&ge;': r'\ge',
+    '&amp;plusmn;': r'\pm', '&plusmn;': r'\pm',
+}
+_RE_HTML_ENTITY = re.compile('|'.join(map(re.escape, _HTML_ENTITIES)))
+
+_RE_IMG_B64 = re.compile(r'!\[.*?\]\(data:image\/.*?;base64,.*?\)')
+_RE_ARRAY = re.compile(r'\\begin\{array\}\s*\[.*?\]', re.DOTALL)
+_RE_TEAM = re.compile(r'^Team\s*[#]?\s*\d+\s*.*$')
+_RE_PAGE = re.compile(r'^Page\s+\d+(?:\s+of\s+\d+)?\s*.*$')
+_RE_ARROWS = re.compile(r'[↪\u21aa]')
+_RE_TOC_PAGE_JOIN = re.compile(r'(\d+\.[\d\.]*.*)\n+(\d+)$', re.MULTILINE)
+_RE_TOC_DOTS = re.compile(r'\.{3,}\s*(\d+)')
+_RE_MULTI_NL = re.compile(r'\n{3,}')
+_RE_IMG_TMP = re.compile(r'__IMG_TMP_(\d+)__')
+
 class ContentIsolator:
     """
     功能：专门负责内容的 提取(Protect) 与 还原(Restore)
@@ -229,7 +654,7 @@ class ContentIsolator:
         """
         通用保护函数
         :param text: 文本
-        :param pattern: 正则表达式
+        :param pattern: 预编译的正则表达式 (见 _PAT_*)
         :param prefix: 占位符前缀 (如 IMG, EQ, TBL)
         """
         def replacer(match):
@@ -238,16 +663,80 @@ class ContentIsolator:
             self.vault[key] = content
             return key
         
-        return re.sub(pattern, replacer, text, flags=re.MULTILINE | re.DOTALL)
+        return pattern.sub(replacer, text)
+
+    def restore(self, text, drop=()):
+        """
+        将占位符还原为原始内容
+        :param text: 含占位符的文本
+        :param drop: 需要直接删除 (而非还原) 的占位符前缀，如 ('IMG', 'TBL')
+        """
+        # 单次扫描所有占位符，按 Key 查表还原 (替换函数直接返回原文，不会被当作正则模板解析)
+        # 递归还原：protect 按顺序执行，后保护的内容 (如表格) 在保护时已经含有先前生成的占位符
+        # (如其中的图片、代码)，取出后必须接着还原这些占位符；drop 同样作用于嵌套的占位符
+        def replacer(match):
+            if match.group(1) in drop:
+                return ''
+            key = match.group(0)
+            if key not in self.vault:
+                return key
+            return self.restore(self.vault[key], drop)
+
+        return _RE_PLACEHOLDER.sub(replacer, text)
+
+# 翻译 System Prompt (针对新占位符优化)
+_SYSTEM_PROMPT = r"""
+            你是一位精通数学建模与科学研究的学术翻译专家。你负责将复杂的学术 Markdown 文档从英文翻译为中文，并保持文档的严谨性与排版完整性。
+
+            ### 📝 翻译规范与格式要求 (必须遵守)：
+            1. **双语对照格式**：采用“逐段对照”原则。输出每一段原文后，紧跟其对应的中文翻译段落。
+            2. **译文引用标识**：所有的中文翻译段落必须且只能包裹在 Markdown 引用块内，即以 `> ` 开头。
+            3. **术语准确性**：使用地道的中国学术语用习惯（如“本文”、“显著性”、“鲁棒性”等）。
+            4. **占位符保留**：
+               - 文本中包含类似 `[[__IMG_n__]]` (图片)、`[[__TBL_n__]]` (表格)、`[[__EQ_BLOCK_n__]]` (块级公式)、`[[__EQ_INLINE_n__]]` (行内公式) 以及 `[[__PB_n__]]` (换页符) 的占位符。
+               - 这些占位符在译文中必须**原样保留**，位置应符合中文语序。
+
+            ### 🚫 绝对禁令 (违者将导致解析崩溃)：
+            1. **严禁修改占位符结构**：
+               - 严禁翻译占位符内部的英文（如把 IMG 翻译成“图片”）。
+               - 严禁在占位符的大括号内部添加任何空格。
+               - ✅ 正确：`> 该模型如 [[__IMG_0__]] 所示。`
+               - ❌ 错误：`> 该模型如 [[ __图片_0__ ]] 所示。`
+
+            2. **严禁在译文中使用公式定界符**：
+               - 严禁在 `> ` 开头的译文中输出 `$$`、`\[`、`\]`、`\begin{...}` 或 `\end{...}`。所有公式必须通过对应的 `[[__EQ_...__]]` 占位符体现。
+
+            3. **禁止翻译纯组件行**：
+               - 如果原文段落只包含占位符（如只有 `[[__EQ_BLOCK_0__]]`）而无文字内容，**严禁**输出对应的 `> ` 译文行，直接跳过并处理下一段。
+
+            4. **禁止翻译孤立噪声**：
+               - 遇到单独的页码数字（如 '1'）、年份（如 '2025'）或 OCR 产生的伪影数字，请直接忽略，不要输出翻译。
+
+            5. **保护 Markdown 语法元字符**：
+               - 严禁修改原文中的标题级数（`#`）、列表符号（`-`、`1.`）或加粗符号（`**`）。
+
+            ### 💡 示例展示：
+            输入：
+            # 1. Introduction
+            The growth of fungi is modeled by [[__EQ_INLINE_0__]].
+            [[__EQ_BLOCK_1__]]
 
-    def restore(self, text):
-        """将占位符还原为原始内容"""
-        # 为了防止偶发的嵌套替换问题，建议按 Key 的长度逆序还原，或者直接遍历
-        # 这里由于 Key 格式固定，直接遍历即可
-        for key, content in self.vault.items():
-            # 使用 replace 而非 re.sub，防止 content 中包含正则敏感字符导致崩溃
-            text = text.replace(key, content)
-        return text
+            输出：
+            # 1. Introduction
+            > # 1. 绪论
+
+            The growth of fungi is modeled by [[__EQ_INLINE_0__]].
+            > 真菌的生长通过 [[__EQ_INLINE_0__]] 进行建模。
+
+            [[__EQ_BLOCK_1__]]
+            (此处不输出译文，因为该段仅包含块级公式占位符)
+            """
+
+# 🟢 全局复用的 DeepSeek 客户端：所有翻译线程共享同一个连接池
+_DS_CLIENT = OpenAI(
+    api_key=DEEPSEEK_API_KEY, 
+    base_url="https://api.deepseek.com"
+)
 
 class SafeTranslator:
     """
@@ -255,10 +744,7 @@ class SafeTranslator:
     特点：彻底隔离图片、代码、公式、表格，只翻译纯文本
     """
     def __init__(self):
-        self.client = OpenAI(
-            api_key=DEEPSEEK_API_KEY, 
-            base_url="https://api.deepseek.com"
-        )
+        self.client = _DS_CLIENT
 
     def translate_bilingual(self, markdown_text):
         if not markdown_text.strip():
@@ -274,7 +760,7 @@ class SafeTranslator:
         # 说明：防止代码里的数学符号或图片标记被误识别
         processed_text = isolator.protect(
             processed_text, 
-            r'```[\s\S]*?```', 
+            _PAT_CODE, 
             "CODE"
         )
 
@@ -282,7 +768,7 @@ class SafeTranslator:
         # 说明：防止 Base64 干扰翻译，同时防止模型修改图片路径
         processed_text = isolator.protect(
             processed_text, 
-            r'!\[.*?\]\(.*?\)', 
+            _PAT_IMG, 
             "IMG"
         )
 
@@ -291,14 +777,14 @@ class SafeTranslator:
         # 注意：这意味着表格内的文字将不会被翻译（通常OCR的表格翻译后格式极难控制，建议保留原文）
         processed_text = isolator.protect(
             processed_text,
-            r'(?:^\|.*?\|\s*$\n?)+',
+            _PAT_TBL,
             "TBL"
         )
 
         # 4. 保护 Block 公式 ($$ ... $$)
         processed_text = isolator.protect(
             processed_text,
-            r'\$\$[\s\S]*?\$\$',
+            _PAT_EQB,
             "EQ_BLOCK"
         )
 
@@ -306,63 +792,16 @@ class SafeTranslator:
         # 说明：使用负向预查 (?<!\\) 防止匹配转义的 \$
         processed_text = isolator.protect(
             processed_text,
-            r'(?<!\\)\$(?!\s).*?(?<!\s)(?<!\\)\$',
+            _PAT_EQI,
             "EQ_INLINE"
         )
 
-        # 构造 System Prompt (针对新占位符优化)
-        system_prompt = r"""
-            你是一位精通数学建模与科学研究的学术翻译专家。你负责将复杂的学术 Markdown 文档从英文翻译为中文，并保持文档的严谨性与排版完整性。
-
-            ### 📝 翻译规范与格式要求 (必须遵守)：
-            1. **双语对照格式**：采用“逐段对照”原则。输出每一段原文后，紧跟其对应的中文翻译段落。
-            2. **译文引用标识**：所有的中文翻译段落必须且只能包裹在 Markdown 引用块内，即以 `> ` 开头。
-            3. **术语准确性**：使用地道的中国学术语用习惯（如“本文”、“显著性”、“鲁棒性”等）。
-            4. **占位符保留**：
-               - 文本中包含类似 `[[__IMG_n__]]` (图片)、`[[__TBL_n__]]` (表格)、`[[__EQ_BLOCK_n__]]` (块级公式)、`[[__EQ_INLINE_n__]]` (行内公式) 以及 `[[__PB_n__]]` (换页符) 的占位符。
-               - 这些占位符在译文中必须**原样保留**，位置应符合中文语序。
-
-            ### 🚫 绝对禁令 (违者将导致解析崩溃)：
-            1. **严禁修改占位符结构**：
-               - 严禁翻译占位符内部的英文（如把 IMG 翻译成“图片”）。
-               - 严禁在占位符的大括号内部添加任何空格。
-               - ✅ 正确：`> 该模型如 [[__IMG_0__]] 所示。`
-               - ❌ 错误：`> 该模型如 [[ __图片_0__ ]] 所示。`
-
-            2. **严禁在译文中使用公式定界符**：
-               - 严禁在 `> ` 开头的译文中输出 `$$`、`\[`、`\]`、`\begin{...}` 或 `\end{...}`。所有公式必须通过对应的 `[[__EQ_...__]]` 占位符体现。
-
-            3. **禁止翻译纯组件行**：
-               - 如果原文段落只包含占位符（如只有 `[[__EQ_BLOCK_0__]]`）而无文字内容，**严禁**输出对应的 `> ` 译文行，直接跳过并处理下一段。
-
-            4. **禁止翻译孤立噪声**：
-               - 遇到单独的页码数字（如 '1'）、年份（如 '2025'）或 OCR 产生的伪影数字，请直接忽略，不要输出翻译。
-
-            5. **保护 Markdown 语法元字符**：
-               - 严禁修改原文中的标题级数（`#`）、列表符号（`-`、`1.`）或加粗符号（`**`）。
-
-            ### 💡 示例展示：
-            输入：
-            # 1. Introduction
-            The growth of fungi is modeled by [[__EQ_INLINE_0__]].
-            [[__EQ_BLOCK_1__]]
-
-            输出：
-            # 1. Introduction
-            > # 1. 绪论
-
-            The growth of fungi is modeled by [[__EQ_INLINE_0__]].
-            > 真菌的生长通过 [[__EQ_INLINE_0__]] 进行建模。
-
-            [[__EQ_BLOCK_1__]]
-            (此处不输出译文，因为该段仅包含块级公式占位符)
-            """
 
         try:
             response = self.client.chat.completions.create(
                 model="deepseek-chat",
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": _SYSTEM_PROMPT},
                     {"role": "user", "content": processed_text}
                 ],
                 stream=False,
@@ -382,28 +821,49 @@ class SafeTranslator:
         
         for line in lines:
             if line.strip().startswith('>'):
-                # 这是译文行：我们要在这里删掉组件占位符
-                # 剔除图片、表格、块级公式占位符，只保留文字
-                clean_line = line
-                # 删掉图片
-                clean_line = re.sub(r'\[\[__IMG_\d+__\]\]', '', clean_line)
-                # 删掉表格
-                clean_line = re.sub(r'\[\[__TBL_\d+__\]\]', '', clean_line)
-                # 删掉块级公式 (可选：如果你希望译文里也不要行内公式，可以一并删掉)
-                clean_line = re.sub(r'\[\[__EQ_BLOCK_\d+__\]\]', '', clean_line)
-                
-                # 还原剩下的文字占位符 (如果有的话)
-                final_lines.append(isolator.restore(clean_line))
+                # 这是译文行：删掉图片、表格、块级公式占位符，只还原文字占位符 (一次扫描完成)
+                final_lines.append(isolator.restore(line, drop=_COMPONENT_PREFIXES))
             else:
                 # 这是原文行：完全还原，保留所有组件
                 final_lines.append(isolator.restore(line))
         
         return '\n'.join(final_lines)
-        
+
+# 全局共享的翻译器实例 (供 translate_chunk 的各个线程复用)
+_translator = SafeTranslator()
+
 def is_likely_toc(text):
-    """检测是否为目录页：寻找‘标题...数字’特征"""
-    toc_lines = re.findall(r'^[^\n]{5,}\s+\d+$', text, re.MULTILINE)
-    return len(toc_lines) >= 3 #
+    """检测是否为目录页：寻找‘标题...数字’特征 (至少 3 处「≥5 字标题 + 空白 + 页码」)"""
+    # 逐行从行尾往前扫数字，凑够 3 处即提前返回，不必扫完整个文本
+    # 页码可能被 OCR 切到下一行 (中间只隔空白行)，此时与上方的标题行配对计 1 处
+    hits = 0
+    title_state = 'none'  # 'ready': 上方有可配对的标题行；'used': 上方标题已计数
+    for line in text.split('\n'):
+        n = len(line)
+        i = n - 1
+        while i >= 0 and line[i].isdecimal():
+            i -= 1
+        head_blank = i < 0 or line[:i + 1].isspace()
+
+        if i < n - 1 and head_blank and title_state != 'none':
+            # 页码单独成行：已与上方标题计过数则跳过，否则配对计数
+            if title_state == 'ready':
+                hits += 1
+            title_state = 'none'
+        elif i < n - 1 and i >= 5 and line[i].isspace():
+            # 同一行内：标题 + 空白 + 页码
+            hits += 1
+            title_state = 'used'
+        elif not line.strip():
+            # 空行 / 纯空白行不打断配对关系
+            if title_state == 'none' and n >= 5:
+                title_state = 'ready'
+        else:
+            title_state = 'ready' if n >= 5 else 'none'
+
+        if hits >= 3:
+            return True
+    return False
         
 # ==================== 🟢 核心修复：后端文本清洗 ====================
 def backend_smart_clean(content):
@@ -416,46 +876,42 @@ def backend_smart_clean(content):
         return f"__IMG_TMP_{len(imgs)-1}__"
     
     # 匹配所有的 Markdown 图片标签 (含 Base64)
-    content = re.sub(r'!\[.*?\]\(data:image\/.*?;base64,.*?\)', _hide, content)
+    content = _RE_IMG_B64.sub(_hide, content)
     
     # 2. 🟢 终极公式修复：暴力还原 HTML 实体
-    # 这里使用顺序替换，先处理二次转义，再处理标准转义
-    content = content.replace('&amp;lt;', '<').replace('&lt;', '<')
-    content = content.replace('&amp;gt;', '>').replace('&gt;', '>')
-    content = content.replace('&amp;le;', r'\le').replace('&le;', r'\le')
-    content = content.replace('&amp;ge;', r'\ge').replace('&ge;', r'\ge')
-    content = content.replace('&amp;plusmn;', r'\pm').replace('&plusmn;', r'\pm')
+    # 单次扫描替换，二次转义形式排在前面优先匹配
+    content = _RE_HTML_ENTITY.sub(lambda m: _HTML_ENTITIES[m.group(0)], content)
 
     # 3. 🟢 修复矩阵语法 (移除 \begin{array}[] 这种非标标记)
     # 使用 re.DOTALL 确保能跨过换行符匹配方括号
-    content = re.sub(r'\\begin\{array\}\s*\[.*?\]', r'\\begin{array}', content, flags=re.DOTALL)
+    content = _RE_ARRAY.sub(r'\\begin{array}', content)
     content = content.replace('[]{cccccc}', '{cccccc}')
 
     # 4. 🟢 移除 OCR 垃圾信息 (同步前端逻辑)
-    ad_keywords = [
-        '获取更多资讯', '优质更多资讯', '國立臺灣大學','数字模型', '数学模型','I would like to get more information.', 
-        '上海', '天津', '文汇', '云江', '太江', '云计', '交往','文江','資訊','大江','关注数学'
-    ]
-    ad_regex = r'^.*(' + '|'.join(ad_keywords) + r').*$'
-    content = re.sub(ad_regex, '', content, flags=re.MULTILINE)
-    
-    # 移除 Team 标记与 Page 页码
-    content = re.sub(r'^Team\s*[#]?\s*\d+\s*.*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^Page\s+\d+(?:\s+of\s+\d+)?\s*.*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'[↪\u21aa]', '', content)
-
-    # 5. 🟢 目录页码对齐
+    # 单次逐行扫描：广告行、Team 标记、Page 页码整行清空 (保留换行)，其余行去掉箭头符号
+    out = []
+    for line in content.split('\n'):
+        if (next(_AD_AUTOMATON.iter(line), None) is not None
+                or _RE_TEAM.match(line) or _RE_PAGE.match(line)):
+            out.append('')
+        else:
+            out.append(_RE_ARROWS.sub('', line))
+    content = '\n'.join(out)
+
+    # 5. 🟢 目录页码对齐 (以下几步需要跨行匹配，单独处理)
     # 将被 OCR 切断的页码数字拉回上一行
-    content = re.sub(r'(\d+\.[\d\.]*.*)\n+(\d+)$', r'\1 \2', content, flags=re.MULTILINE)
+    content = _RE_TOC_PAGE_JOIN.sub(r'\1 \2', content)
     # 处理目录点号：Title .... 12 -> Title 12
-    content = re.sub(r'\.{3,}\s*(\d+)', r' \1', content)
+    content = _RE_TOC_DOTS.sub(r' \1', content)
     
     # 6. 🟢 结构压缩
-    content = re.sub(r'\n{3,}', '\n\n', content)
+    content = _RE_MULTI_NL.sub('\n\n', content)
 
-    # 7. 🟢 还原图片
-    for i, raw in enumerate(imgs):
-        content = content.replace(f"__IMG_TMP_{i}__", raw)
+    # 7. 🟢 还原图片 (单次扫描，按序号查表)
+    def _show(m):
+        i = int(m.group(1))
+        return imgs[i] if i < len(imgs) else m.group(0)
+    content = _RE_IMG_TMP.sub(_show, content)
     
     return content.strip()
 
@@ -484,7 +940,7 @@ def smart_chunk_text(text, max_chars=2000):
 
         # 🟢 目录优化：如果是目录模式，且遇到章节标题（如 "1 Introduction"）
         # 则强制开启新块，避免把目录的不同章节混在一起翻译导致散乱
-        if is_toc_mode and re.match(r'^\d+\s+[A-Z\u4e00-\u9fa5]', para.strip()):
+        if is_toc_mode and _RE_TOC_CHAPTER.match(para.strip()):
             if current_batch:
                 batches.append("\n\n".join(current_batch))
                 current_batch = []
@@ -501,16 +957,17 @@ def smart_chunk_text(text, max_chars=2000):
             
             # 内部切分逻辑
             lines = para.split('\n')
+            line_lens = [len(line) for line in lines]
             temp_chunk = []
             temp_len = 0
-            for line in lines:
-                if temp_len + len(line) > max_chars and temp_chunk:
+            for i, line_len in enumerate(line_lens):
+                if temp_len + line_len > max_chars and temp_chunk:
                     batches.append("\n".join(temp_chunk))
-                    temp_chunk = [line]
-                    temp_len = len(line)
+                    temp_chunk = [lines[i]]
+                    temp_len = line_len
                 else:
-                    temp_chunk.append(line)
-                    temp_len += len(line)
+                    temp_chunk.append(lines[i])
+                    temp_len += line_len
             if temp_chunk:
                 batches.append("\n".join(temp_chunk))
                 
@@ -539,9 +996,8 @@ def translate_chunk(text_chunk):
     if not text_chunk.strip():
         return ""
     try:
-        # 实例化新的 SafeTranslator (它现在包含 Advanced Isolation 逻辑)
-        local_translator = SafeTranslator()
-        return local_translator.translate_bilingual(text_chunk)
+        # 共享同一个 SafeTranslator (无状态，隔离器在每次调用内部单独创建)
+        return _translator.translate_bilingual(text_chunk)
     except Exception as e:
         print(f"❌ 批次翻译失败: {e}")
         # 如果翻译挂了，至少返回原文，不要让用户看到报错堆栈
@@ -551,12 +1007,66 @@ def translate_chunk(text_chunk):
 # 🟢 第四部分：OCR 引擎模块 (Mistral OCR)
 # ==============================================================================
 
+# 匹配 OCR 结果中的图片引用 ![...](img_id)
+_RE_IMG_REF = re.compile(r'!\[.*?\]\((.*?)\)')
+
+@functools.lru_cache(maxsize=1)
 def get_mistral_client():
-    """获取配置好的 Mistral 客户端"""
+    """获取配置好的 Mistral 客户端 (全局复用同一个实例，保持连接池)"""
     if not MISTRAL_API_KEY or "您的" in MISTRAL_API_KEY:
         raise ValueError("请在 app.py 中填写有效的 Mistral API Key")
     return Mistral(api_key=MISTRAL_API_KEY)
 
+def _encode_data_uri(file_content_bytes, mime_type):
+    """
+    功能：将文件编码为 Base64 Data URI。
+    """
+    # 先拼 bytes，最后只 decode 一次
+    return (b"data:" + mime_type.encode() + b";base64,"
+            + base64.b64encode(file_content_bytes)).decode('ascii')
+
+def _ocr_call(data_uri):
+    """
+    功能：以 Data URI 调用 Mistral OCR，并把图片 ID 替换为 Base64。
+
+    :param data_uri: 文件的 Base64 Data URI
+    :return: 包含 Base64 图片的 Markdown 字符串
+    """
+    client = get_mistral_client()
+    
+    # 1. 调用 API
+    ocr_response = client.ocr.process(
+        model="mistral-ocr-latest",
+        document={
+            "type": "document_url",
+            "document_url": data_uri
+        },
+        include_image_base64=True
+    )
+    
+    full_markdown = ""
+    image_map = {}
+    
+    # 2. 解析结果，提取 Markdown 和图片
+    for page in ocr_response.pages:
+        for img in page.images:
+            image_map[img.id] = img.image_base64
+        
+        # 🟢 添加自定义分页标记，用于前端同步滚动
+        full_markdown += f"\n\n[[PAGE_BREAK]]\n\n{page.markdown}"
+
+    # 3. 将 Markdown 中的图片 ID 替换为 Base64
+    def replace_img_ref(match):
+        img_id = match.group(1)
+        if img_id in image_map:
+            b64_data = image_map[img_id]
+            if not b64_data.startswith("data:"):
+                b64_data = f"data:image/jpeg;base64,{b64_data}"
+            return f"![image]({b64_data})"
+        return match.group(0)
+
+    return _RE_IMG_REF.sub(replace_img_ref, full_markdown)
+
 def process_chunk_with_mistral(file_content_bytes, mime_type, filename_base):
     """
     功能：调用 Mistral OCR API 处理单个 PDF/图片块。
@@ -567,45 +1077,8 @@ def process_chunk_with_mistral(file_content_bytes, mime_type, filename_base):
     :return: 包含 Base64 图片的 Markdown 字符串
     """
     try:
-        # 1. 编码为 Base64 Data URI
-        base64_encoded = base64.b64encode(file_content_bytes).decode('utf-8')
-        data_uri = f"data:{mime_type};base64,{base64_encoded}"
-
-        client = get_mistral_client()
-        
-        # 2. 调用 API
-        ocr_response = client.ocr.process(
-            model="mistral-ocr-latest",
-            document={
-                "type": "document_url",
-                "document_url": data_uri
-            },
-            include_image_base64=True
-        )
-        
-        full_markdown = ""
-        image_map = {}
-        
-        # 3. 解析结果，提取 Markdown 和图片
-        for page in ocr_response.pages:
-            for img in page.images:
-                image_map[img.id] = img.image_base64
-            
-            # 🟢 添加自定义分页标记，用于前端同步滚动
-            full_markdown += f"\n\n[[PAGE_BREAK]]\n\n{page.markdown}"
-
-        # 4. 将 Markdown 中的图片 ID 替换为 Base64
-        def replace_img_ref(match):
-            img_id = match.group(1)
-            if img_id in image_map:
-                b64_data = image_map[img_id]
-                if not b64_data.startswith("data:"):
-                    b64_data = f"data:image/jpeg;base64,{b64_data}"
-                return f"![image]({b64_data})"
-            return match.group(0)
-
-        final_markdown = re.sub(r'!\[.*?\]\((.*?)\)', replace_img_ref, full_markdown)
-        return final_markdown
+        data_uri = _encode_data_uri(file_content_bytes, mime_type)
+        return _ocr_call(data_uri)
         
     except Exception as e:
         print(f"❌ Mistral 处理 {filename_base} 失败: {e}")
@@ -620,6 +1093,11 @@ def index():
     """渲染主页"""
     return render_template('index.html')
 
+def _iter_upstream(resp, chunk_size=65536):
+    """逐块转发上游响应内容 (连接的释放由调用方通过 response.call_on_close 注册)"""
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        yield chunk
+
 @app.route('/gh_proxy')
 def gh_proxy():
     """
@@ -632,17 +1110,34 @@ def gh_proxy():
     
     if not path: return "No path specified", 400
     
-    url = f"{GITHUB_API_BASE}/{urllib.parse.quote(path)}"
+    # PDF.js 等查看器会用 Range 分段请求，原样转发给上游，只传输需要的字节
+    range_hdr = request.headers.get('Range')
+    upstream_headers = {'Range': range_hdr} if range_hdr else None
+    raw_headers = {**GH_RAW_HEADERS, 'Range': range_hdr} if range_hdr else GH_RAW_HEADERS
     
     try:
-        # 1. 获取文件元数据 (含 download_url)
-        meta_resp = requests.get(url, headers=GH_HEADERS)
-        if meta_resp.status_code != 200: 
-            return f"File not found on GitHub: {meta_resp.text}", 404
+        # 1. 直接从 raw.githubusercontent.com 流式下载 (省掉一次 contents API 元数据请求)
+        file_resp = _gh_session.get(_raw_url(path), headers=upstream_headers, stream=True)
+        
+        # 2. raw 地址找不到时 (如分支名未配置)，回退到 contents API，以 raw 格式一次拿到文件内容
+        if file_resp.status_code == 404:
+            file_resp.close()
+            file_resp = _gh_session.get(_contents_url(path), headers=raw_headers, stream=True)
+            if file_resp.status_code == 404:
+                file_resp.close()
+                return "File not found on GitHub", 404
+        
+        # 416: 请求的范围越界，连同 Content-Range 一起告诉客户端
+        if file_resp.status_code == 416:
+            file_resp.close()
+            return Response(status=416, headers={
+                'Content-Range': file_resp.headers.get('Content-Range', ''),
+                'Accept-Ranges': 'bytes'
+            })
         
-        # 2. 下载实际文件内容
-        download_url = meta_resp.json().get('download_url')
-        file_resp = requests.get(download_url, headers=GH_HEADERS)
+        if file_resp.status_code not in (200, 206):
+            file_resp.close()
+            return f"File not found on GitHub: {file_resp.status_code}", 404
         
         # 3. 构造响应类型
         mimetype = 'text/plain'
@@ -650,7 +1145,16 @@ def gh_proxy():
         elif path.endswith('.md'): mimetype = 'text/markdown'
         elif path.endswith(('.jpg', '.png')): mimetype = 'image/jpeg'
         
-        response = Response(file_resp.content, mimetype=mimetype)
+        # 按 64KB 分块转发，不在 Flask 进程里缓存整个文件
+        response = Response(_iter_upstream(file_resp), status=file_resp.status_code, mimetype=mimetype)
+        # 无论生成器是否开始迭代 (HEAD 请求、首块前客户端断开)，响应关闭时都释放上游连接
+        response.call_on_close(file_resp.close)
+        response.headers['Accept-Ranges'] = 'bytes'
+        if 'Content-Range' in file_resp.headers:
+            response.headers['Content-Range'] = file_resp.headers['Content-Range']
+        # 上游压缩传输时 iter_content 输出的是解压后的内容，长度对不上，只有未压缩时才转发
+        if 'Content-Length' in file_resp.headers and 'Content-Encoding' not in file_resp.headers:
+            response.headers['Content-Length'] = file_resp.headers['Content-Length']
 
         # 4. 如果请求下载，添加附件头
         if should_download:
@@ -684,27 +1188,42 @@ def get_history_list():
     """
     user_id = request.args.get('user', 's1')
     
-    # 优先从管理器读取
-    items = history_manager.get(user_id)
+    # 优先从管理器读取 (版本号与列表一起取，ETag 和响应缓存都以它为准)
+    version, items = history_manager.snapshot(user_id)
     
-    if items:
+    # 空列表也是有效缓存 (该用户暂无文件)，只有从未同步过 (None) 才去 GitHub 拉取
+    if items is not None:
         print(f"⚡ [Cache Hit] 命中持久化缓存: {user_id}")
     else:
         print(f"🐢 [Cache Miss] 缓存失效，正在同步...")
-        items = _fetch_github_data(user_id)
-        history_manager.set(user_id, items)
+        # _fetch_github_data 成功时已写入 history_manager，这里不再重复 set，重新取一次快照即可
+        _fetch_github_data(user_id)
+        version, items = history_manager.snapshot(user_id)
+        if items is None:
+            # 同步失败 (GitHub 不可用)：返回空列表，但不带 ETag、不写响应缓存
+            return Response(b'[]', mimetype='application/json')
     
-    # 3. 补全 URL (url_for 需要在请求上下文中运行)
-    # 因为缓存里存的是 path，这里动态生成最终 URL
-    final_items = []
-    for item in items:
-        # 浅拷贝一下，避免修改缓存里的原始数据
-        new_item = item.copy() 
-        new_item['pdf_url'] = url_for('gh_proxy', path=item['pdf_path'])
-        new_item['md_url'] = url_for('gh_proxy', path=item['md_path'])
-        final_items.append(new_item)
-
-    return jsonify(final_items)
+    # 浏览器带着同一版本的 ETag 来请求时，直接返回 304，不再传输列表
+    # 浏览器按完整 URL (含 ?user=) 区分缓存，ETag 不必带用户 ID；也避免把未校验的参数写进响应头
+    etag = f"{history_manager.instance_id}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        # 列表未变化时直接返回上次序列化好的响应，跳过序列化
+        cached = history_manager.responses.get(user_id)
+        if cached and cached[0] == version:
+            body = cached[1]
+        else:
+            # 3. pdf_url / md_url 已在 history_manager.set 时补全，直接序列化缓存列表
+            # orjson 直接输出 bytes，比 jsonify (标准库 json) 快得多
+            body = orjson.dumps(items)
+            history_manager.responses[user_id] = (version, body)
+        response = Response(body, mimetype='application/json')
+    
+    # 每次都向服务端确认 ETag，保证上传 / 删除后立刻看到新列表
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -730,105 +1249,108 @@ def upload_file():
     gh_pdf_path = f"{user_id}/{task_id}.{file_extension}"
     gh_md_path = f"{user_id}/{task_id}.md"
 
-    temp_filepath = None
-    temp_md_path = None
     all_markdown_chunks = []
 
     try:
-        # 3. 保存上传文件到临时目录
-        temp_dir = tempfile.gettempdir()
-        temp_filepath = os.path.join(temp_dir, f"{task_id}.{file_extension}")
-        file.save(temp_filepath)
-        
-        final_markdown = ""
-
-        # 4. 根据文件类型处理
-        if file_extension == 'pdf':
-            # --- PDF 处理流程 (分块) ---
-            reader = PdfReader(temp_filepath)
-            total_pages = len(reader.pages)
+        # 临时目录随 with 退出自动删除 (包括中途抛异常)，无需逐个清理
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # 3. 保存上传文件到临时目录 (上传 GitHub 时需要本地文件)
+            temp_filepath = os.path.join(temp_dir, f"{task_id}.{file_extension}")
+            is_image = file_extension in ['jpg', 'jpeg', 'png']
+            if is_image:
+                # 图片直接从上传流读入内存，写盘一次，后面 OCR 不必再从磁盘读回
+                image_bytes = file.stream.read()
+                with open(temp_filepath, "wb") as f:
+                    f.write(image_bytes)
+            else:
+                # 按 1MB 分块从上传流拷贝到磁盘
+                file.save(temp_filepath, buffer_size=UPLOAD_BUFFER_SIZE)
+        
+            final_markdown = ""
+
+            # 4. 根据文件类型处理
+            if file_extension == 'pdf':
+                # --- PDF 处理流程 (分块) ---
+                chunk_args = []
             
-            for start_page in range(0, total_pages, PAGE_CHUNK_SIZE):
-                end_page = min(start_page + PAGE_CHUNK_SIZE, total_pages)
-                page_range_str = f"P{start_page+1}-P{end_page}"
-                
-                # 创建临时分块文件
-                writer = PdfWriter()
-                for i in range(start_page, end_page):
-                    writer.add_page(reader.pages[i])
-                
-                temp_chunk_path = os.path.join(temp_dir, f"{task_id}_{page_range_str}.pdf")
-                with open(temp_chunk_path, "wb") as output_stream:
-                    writer.write(output_stream)
+                # pikepdf (QPDF) 在 C++ 层复制页面，字体/图片等共享资源按引用复用
+                with pikepdf.open(temp_filepath) as src:
+                    total_pages = len(src.pages)
                 
-                # 读取分块并调用 OCR
-                with open(temp_chunk_path, "rb") as chunk_file:
-                    chunk_bytes = chunk_file.read()
-                
-                print(f"🔄 Processing chunk: {page_range_str}")
-                markdown_chunk = process_chunk_with_mistral(
-                    chunk_bytes, "application/pdf", f"{task_id}_{page_range_str}"
-                )
-                
-                all_markdown_chunks.append(markdown_chunk)
-                os.remove(temp_chunk_path) # 清理分块
+                    for start_page in range(0, total_pages, PAGE_CHUNK_SIZE):
+                        end_page = min(start_page + PAGE_CHUNK_SIZE, total_pages)
+                        page_range_str = f"P{start_page+1}-P{end_page}"
+                    
+                        # 在内存中生成分块 PDF (无需落盘再读回)，稍后统一并发调用 OCR
+                        with pikepdf.Pdf.new() as dst:
+                            dst.pages.extend(src.pages[start_page:end_page])
+                            buf = io.BytesIO()
+                            dst.save(buf)
+                        chunk_bytes = buf.getvalue()
+                    
+                        chunk_args.append((chunk_bytes, "application/pdf", f"{task_id}_{page_range_str}"))
             
-            # 合并结果，使用同步标记
-            final_markdown = "\n----------\n".join(all_markdown_chunks)
-        
-        elif file_extension in ['jpg', 'jpeg', 'png']:
-            # --- 图片处理流程 ---
-            with open(temp_filepath, "rb") as image_file:
-                chunk_bytes = image_file.read()
-            final_markdown = process_chunk_with_mistral(
-                chunk_bytes, f"image/{file_extension}", task_id
-            )
+                # 并发调用 OCR (map 保证结果顺序与页码顺序一致)
+                print(f"🔄 Processing {len(chunk_args)} chunks concurrently...")
+                with ThreadPoolExecutor(max_workers=max(1, min(OCR_MAX_WORKERS, len(chunk_args)))) as executor:
+                    all_markdown_chunks = list(executor.map(lambda args: process_chunk_with_mistral(*args), chunk_args))
+            
+                # 合并结果，使用同步标记
+                final_markdown = "\n----------\n".join(all_markdown_chunks)
+        
+            elif is_image:
+                # --- 图片处理流程 ---
+                final_markdown = process_chunk_with_mistral(
+                    image_bytes, f"image/{file_extension}", task_id
+                )
         
-        if not final_markdown: final_markdown = "# ⚠️ 识别内容为空"
+            if not final_markdown: final_markdown = "# ⚠️ 识别内容为空"
 
-        if final_markdown:
-            # 🟢 必须在这里调用清洗函数，修复上传后的原始 MD
-            final_markdown = backend_smart_clean(final_markdown)
+            if final_markdown:
+                # 🟢 必须在这里调用清洗函数，修复上传后的原始 MD
+                final_markdown = backend_smart_clean(final_markdown)
 
-        # 5. 上传结果到 GitHub
-        # 5.1 上传源文件 (PDF/Image)
-        print(f"☁️ Uploading source to {gh_pdf_path}...")
-        if not upload_to_github(temp_filepath, gh_pdf_path, f"Add source: {filename}"):
-             raise Exception("Failed to upload source file.")
-        
-        # 5.2 上传 Markdown
-        temp_md_path = os.path.join(temp_dir, f"{task_id}.md")
-        with open(temp_md_path, "w", encoding="utf-8") as f:
-            f.write(final_markdown)
+            # 5. 上传结果到 GitHub (源文件 + Markdown 合并为一次提交)
+            temp_md_path = os.path.join(temp_dir, f"{task_id}.md")
+            with open(temp_md_path, "w", encoding="utf-8") as f:
+                f.write(final_markdown)
         
-        print(f"☁️ Uploading markdown to {gh_md_path}...")
-        if not upload_to_github(temp_md_path, gh_md_path, f"Add markdown: {filename}"):
-             raise Exception("Failed to upload markdown.")
+            print(f"☁️ Uploading source & markdown to {gh_pdf_path}, {gh_md_path}...")
+            if not upload_many_to_github(
+                [(temp_filepath, gh_pdf_path), (temp_md_path, gh_md_path)],
+                f"Add source & markdown: {filename}"
+            ):
+                 raise Exception("Failed to upload source file or markdown.")
         
-        # 🟢 核心修改：上传成功后，让缓存失效或立即刷新
-        # 方案：开启一个线程，稍后刷新该用户的缓存
-        print(f"♻️ 上传成功，触发后台缓存刷新: {user_id}")
-        refresh_thread = threading.Thread(target=background_refresh_task, args=(user_id,))
-        refresh_thread.start()
+            # 🟢 核心修改：上传成功后直接把新条目写入缓存
+            # 新增的文件是已知的，无需再从 GitHub 重新拉取整个文件树
+            print(f"♻️ 上传成功，更新缓存: {user_id}")
+            history_manager.append(user_id, _history_item(task_id, gh_pdf_path, gh_md_path, timestamp))
         
-        # 6. 返回结果
-        return jsonify({
-            'markdown': final_markdown,
-            'download_url': url_for('gh_proxy', path=gh_md_path, download='true'),
-            'pdf_url': url_for('gh_proxy', path=gh_pdf_path),
-            'gh_path': gh_md_path
-        })
+            # 6. 返回结果
+            return jsonify({
+                'markdown': final_markdown,
+                'download_url': url_for('gh_proxy', path=gh_md_path, download='true'),
+                'pdf_url': url_for('gh_proxy', path=gh_pdf_path),
+                'gh_path': gh_md_path
+            })
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': f"Processing Error: {str(e)}"}), 500
-        
-    finally:
-        # 7. 清理临时文件
-        if temp_filepath and os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
-        if temp_md_path and os.path.exists(temp_md_path):
-            os.remove(temp_md_path)
+
+def _upload_translation_async(dual_path, dual_content):
+    """线程入口函数：把翻译结果写入临时文件并上传 GitHub，完成后清理"""
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_dual_path = os.path.join(temp_dir, os.path.basename(dual_path))
+            with open(temp_dual_path, "w", encoding="utf-8") as f:
+                f.write(dual_content)
+            print(f"☁️ Uploading translation to {dual_path}...")
+            if not upload_to_github(temp_dual_path, dual_path, "Add AI Translation"):
+                print(f"❌ 翻译结果上传失败: {dual_path}")
+    except Exception:
+        traceback.print_exc()
 
 @app.route('/translate', methods=['POST'])
 def translate_file():
@@ -845,22 +1367,23 @@ def translate_file():
     
     try:
         # 1. 检查 GitHub 是否已有翻译缓存
-        check_url = f"{GITHUB_API_BASE}/{urllib.parse.quote(dual_path)}"
-        if requests.get(check_url, headers=GH_HEADERS).status_code == 200:
+        check_url = _contents_url(dual_path)
+        # 以 raw 格式请求：存在与否和文件内容从同一个响应里取
+        check_resp = _gh_session.get(check_url, headers=GH_RAW_HEADERS)
+        if check_resp.status_code == 200:
             print("✅ Cache hit for translation.")
-            download_url = requests.get(check_url, headers=GH_HEADERS).json().get('download_url')
             return jsonify({
-                'content': requests.get(download_url, headers=GH_HEADERS).text, 
+                'content': check_resp.content.decode('utf-8'), 
                 'status': 'cached',
                 'dual_url': url_for('gh_proxy', path=dual_path, download='true')
             })
 
         # 2. 下载原始 Markdown
-        original_meta_url = f"{GITHUB_API_BASE}/{urllib.parse.quote(gh_path)}"
-        meta_resp = requests.get(original_meta_url, headers=GH_HEADERS)
-        if meta_resp.status_code != 200: return jsonify({'error': 'Original file not found'}), 404
+        original_meta_url = _contents_url(gh_path)
+        original_resp = _gh_session.get(original_meta_url, headers=GH_RAW_HEADERS)
+        if original_resp.status_code != 200: return jsonify({'error': 'Original file not found'}), 404
         
-        original_content = requests.get(meta_resp.json().get('download_url'), headers=GH_HEADERS).text
+        original_content = original_resp.content.decode('utf-8')
         
         # 1. 后端清洗 (同步之前前端的清洗逻辑)
         clean_content = backend_smart_clean(original_content)
@@ -870,24 +1393,16 @@ def translate_file():
         
         print(f"🚀 开始并发翻译，共 {len(batches)} 个批次...")
 
-        # 3. 使用并发执行全局辅助函数
-        with ThreadPoolExecutor(max_workers=8) as executor:
+        # 3. 使用并发执行全局辅助函数 (线程数不超过批次数，单批次文档不额外起线程)
+        with ThreadPoolExecutor(max_workers=max(1, min(TRANSLATE_MAX_WORKERS, len(batches)))) as executor:
             # 使用全局函数 translate_chunk 避免闭包引用错误
             dual_chunks = list(executor.map(translate_chunk, batches))
 
-        dual_content = "\n\n".join(dual_chunks)
-
         # 重新组合
         dual_content = "\n\n".join(dual_chunks)
         
-        # 4. 上传翻译结果
-        temp_dual_path = os.path.join(tempfile.gettempdir(), "temp_dual.md")
-        with open(temp_dual_path, "w", encoding="utf-8") as f:
-            f.write(dual_content)
-            
-        print(f"☁️ Uploading translation to {dual_path}...")
-        upload_to_github(temp_dual_path, dual_path, "Add AI Translation")
-        os.remove(temp_dual_path)
+        # 4. 后台线程上传翻译结果，译文先返回给前端，不等待 GitHub 提交完成
+        threading.Thread(target=_upload_translation_async, args=(dual_path, dual_content)).start()
         
         return jsonify({
             'content': dual_content, 
@@ -918,30 +1433,29 @@ def delete_history():
             md_path.replace('.md', '_dual.md')
         ]
         
-        results = []
-        for path in files_to_delete:
-            # 2. 获取文件的 SHA 值（GitHub 删除文件必须提供 SHA）
-            url = f"{GITHUB_API_BASE}/{urllib.parse.quote(path)}"
-            resp = requests.get(url, headers=GH_HEADERS)
-            
-            if resp.status_code == 200:
-                sha = resp.json().get('sha')
-                
-                # 3. 执行删除操作
-                del_payload = {
-                    "message": f"🗑️ 彻底删除文档: {path}",
-                    "sha": sha,
-                    "branch": GITHUB_BRANCH
-                }
-                del_resp = requests.delete(url, json=del_payload, headers=GH_HEADERS)
-                results.append(f"{path}: {del_resp.status_code}")
-            else:
-                results.append(f"{path}: 跳过 (文件不存在)")
-
-        # 4. 关键：删除后必须强制刷新本地缓存
-        # 这样下次前端请求列表时，看到的就是更新后的数据
-        print(f"♻️ 文件删除成功，正在刷新 {user_id} 的缓存...")
-        _fetch_github_data(user_id)
+        # 2. 在同一个提交里删除所有存在的文件
+        results, all_deleted = delete_many_from_github(files_to_delete, f"🗑️ 彻底删除文档: {pdf_path}")
+
+        # 3. 关键：删除后必须刷新本地缓存
+        # 全部删除成功时先把该 PDF 对应的条目从缓存中去掉，下次前端请求列表时立即看到删除结果；
+        # 有文件删除失败时保留条目，并丢弃旧 ETag，保证后台同步完整拉取文件树而不是拿到 304
+        # 完整的 GitHub 同步放到后台线程，不阻塞响应
+        if all_deleted:
+            items = history_manager.get(user_id)
+            if items is not None:
+                history_manager.set(user_id, [item for item in items if item['pdf_path'] != pdf_path])
+        else:
+            history_manager.forget_etag(user_id)
+        print(f"♻️ 删除请求已完成，正在后台刷新 {user_id} 的缓存...")
+        threading.Thread(target=background_refresh_task, args=(user_id,)).start()
+        
+        if not all_deleted:
+            # 部分文件未能删除 (或无法确认是否存在)，如实告诉前端
+            return jsonify({
+                'status': 'error',
+                'details': results,
+                'message': '部分文件未能从 GitHub 删除，请稍后重试'
+            }), 502
         
         return jsonify({
             'status': 'success', 